@@ -3,15 +3,19 @@ from __future__ import annotations
 import functools
 import json
 import logging
+import os
+import random
 import re
 import time
-from datetime import datetime
-from typing import Optional, Any, Literal, Union, Protocol
+from datetime import datetime, timedelta
+from typing import Optional, Any, Literal, TypedDict, Union, Protocol
 from urllib.parse import urlparse, parse_qs, urlencode, quote, quote_plus
 
-import requests
-from bs4 import BeautifulSoup, Tag
+import diskcache
+import httpx
+import orjson
 from pydantic import BaseModel, Field
+from selectolax.lexbor import LexborHTMLParser, LexborNode
 from rich.logging import RichHandler
 
 from settings import COHOST_COOKIE, SCRATCHPAD_HANDLE
@@ -24,10 +28,25 @@ except ImportError:
 
 log = logging.getLogger("cohostpy")
 MAX_RETRY = 10
-
-client = requests.Session()
-client.cookies.set("connect.sid", COHOST_COOKIE)
-client.headers.update({"User-Agent": "cohost-randombot operated by @quae-nihl"})
+MAX_SLEEP = 600  # seconds; don't hang the whole run on one long retry-after
+TAG_CACHE_TTL = 6 * 3600  # seconds
+LOGIN_CACHE_FILE = ".login_cache.json"
+LOGIN_CACHE_TTL = 24 * 3600  # seconds
+
+_tag_cache = diskcache.Cache(".tag_cache")
+
+# HTTP/2 multiplexes all the small API calls over one connection, so bursts
+# (threaded tag checks, get_author_hacky's create/info/delete) don't
+# head-of-line-block each other or pay extra TLS handshakes
+client = httpx.Client(
+    http2=True,
+    headers={"User-Agent": "cohost-randombot operated by @quae-nihl"},
+    cookies={"connect.sid": COHOST_COOKIE},
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+    timeout=None,
+    # requests followed redirects; httpx doesn't unless told to
+    follow_redirects=True,
+)
 
 
 class AttachmentBlock(BaseModel):
@@ -116,7 +135,8 @@ class PostModel(BaseModel):
     canShare: bool
     canPublish: bool
     limitedVisibilityReason: str
-    astMap: dict = Field(repr=False)  # generic. we don't need this.
+    # astMap (the rendered markdown AST) is intentionally absent: we don't
+    # need it, and it can dwarf the rest of the post. see _strip_ast_map.
     responseToAskId: Optional[int]
 
 
@@ -144,6 +164,35 @@ class ExtendedInfoModel(BaseModel):
     comments: dict[str, list[CommentModel]]
 
 
+# The hot paths (randomizer, manager) only read a handful of fields, so they
+# work on the raw response dicts instead of paying Pydantic validation for
+# every nested submodel. These TypedDicts are editor hints only -- the real
+# responses carry many more keys than are declared here.
+class ProjectDict(TypedDict):
+    projectId: int
+    handle: str
+    displayName: Optional[str]
+
+
+class PostDict(TypedDict):
+    postId: int
+    headline: str
+    transparentShareOfPostId: Optional[int]
+    shareOfPostId: Optional[int]
+    cws: list[str]
+    tags: list[str]
+    commentsLocked: bool
+    postingProject: ProjectDict
+    shareTree: list["PostDict"]
+    singlePostPageUrl: str
+    effectiveAdultContent: bool
+    canShare: bool
+
+
+class ExtendedInfoDict(TypedDict):
+    post: PostDict
+
+
 class AskModel(BaseModel):
     class MinimalProjectModel(BaseModel):
         projectId: int
@@ -162,10 +211,37 @@ class AskModel(BaseModel):
     sentAt: str
 
 
+def _strip_ast_map(extinfo: dict) -> dict:
+    # drop the (huge) AST blobs before validation so Pydantic never has to
+    # walk or store them
+    post = extinfo.get("post", {})
+    post.pop("astMap", None)
+    for shared in post.get("shareTree", []):
+        shared.pop("astMap", None)
+    return extinfo
+
+
+def _json(resp: httpx.Response):
+    # orjson is considerably faster than the stdlib parser on the big
+    # singlePost payloads (post + shareTree + astMap)
+    return orjson.loads(resp.content)
+
+
 def _try_with_backoff(url: str, method: str = "GET", json: Any | None = None):
     failures = 0
+    relogged = False
     while 1:
         resp = client.request(method, url, json=json)
+        if resp.status_code == 401 and not relogged:
+            # warm-start login cache may be stale; re-login once for real
+            log.warning("got 401, invalidating login cache")
+            _invalidate_login()
+            relogged = True
+            if _am_login_live()[0]:
+                continue
+            # the cookie itself is dead; callers can't recover from this
+            # (and would otherwise retry forever on the ValueError path)
+            raise PermissionError(f"got 401 for {url} and re-login failed")
         if resp.status_code == 418 or 500 <= resp.status_code <= 599:  # slow down!!
             log.warning(f"bad status {resp.status_code}")
             failures += 1
@@ -174,16 +250,24 @@ def _try_with_backoff(url: str, method: str = "GET", json: Any | None = None):
             # is there a retry-after
             if "retry-after" in resp.headers:
                 new_schedule = parse_retry_after(resp.headers["retry-after"], failures)
-                duration = new_schedule - datetime.now()
+                # jitter so everyone honoring the same retry-after doesn't
+                # come back at the exact same moment
+                duration = (
+                    new_schedule
+                    - datetime.now()
+                    + timedelta(seconds=random.uniform(0, 1))
+                )
             else:
                 # guess??
                 duration = backoff(failures)
             log.info(f"waiting {duration} to cool down")
-            time.sleep(duration.seconds)
+            # .seconds would drop the days component of a long retry-after
+            # and hammer the server right away
+            time.sleep(min(MAX_SLEEP, max(0.0, duration.total_seconds())))
             continue
         elif resp.status_code != 200:
             try:
-                js = resp.json()
+                js = _json(resp)
                 if "message" in js:
                     rp(js["message"].strip())
                 if "message" in js["error"]:
@@ -218,18 +302,32 @@ def delete(post_id: int, author: str):
         "posts.delete",
         {"postId": post_id, "projectHandle": author},
     )
+    _invalidate()
+
+
+def post_info_raw(post_id: int, author: str) -> ExtendedInfoDict:
+    extinfo = _json(_trpc("posts.singlePost", {"postId": post_id, "handle": author}))
+    return _strip_ast_map(extinfo["result"]["data"])
 
 
 def post_info(post_id: int, author: str) -> ExtendedInfoModel:
-    extinfo = _trpc("posts.singlePost", {"postId": post_id, "handle": author}).json()
     # shove it into the box
-    return ExtendedInfoModel(**extinfo["result"]["data"])
+    return ExtendedInfoModel(**post_info_raw(post_id, author))
+
 
+_AUTHOR_RE = re.compile(rb'"/api/v1/project/([^"/]+)"')
 
+
+@functools.lru_cache(maxsize=256)
 def get_author_classic(pid: int):
-    basic_info = _try_with_backoff(
-        f"https://cohost.org/api/v1/project_post/{pid}"
-    ).json()
+    resp = _try_with_backoff(f"https://cohost.org/api/v1/project_post/{pid}")
+    # fast path: the project link is easy to spot without parsing the whole
+    # JSON body. the /posts variant doesn't match (no closing quote after
+    # the handle).
+    for found in _AUTHOR_RE.finditer(resp.content):
+        if found.group(1) != b"posts":
+            return found.group(1).decode()
+    basic_info = _json(resp)
     author = list(
         filter(
             lambda x: x["href"].startswith("/api/v1/project/")
@@ -268,7 +366,7 @@ class _TagAnalyzeProtocol(Protocol):
         ...
 
 
-@functools.cache  # we really shouldn't be spamming this.
+@_tag_cache.memoize(expire=TAG_CACHE_TTL)  # we really shouldn't be spamming this.
 def _tag_analyze(tag_name: str, target: int, max_pages: int = 10) -> tuple[bool, str]:
     """
     Count authors posting to a tag.
@@ -277,13 +375,13 @@ def _tag_analyze(tag_name: str, target: int, max_pages: int = 10) -> tuple[bool,
     :param max_pages: maximum pages to query
     :return: count
     """
-    # We pull out the beautifulsoup4 for this one. please provide a tag api ;(
+    # We pull out the HTML parser for this one. please provide a tag api ;(
 
     reft = None
     page_count = 0
     uniques = set()
     offset = 0
-    while page_count < max_pages:  # and len(uniques) < target
+    while page_count < max_pages:
         url = f"https://cohost.org/rc/tagged/{quote(tag_name)}?"
         query = {}
         if offset > 0:
@@ -294,28 +392,29 @@ def _tag_analyze(tag_name: str, target: int, max_pages: int = 10) -> tuple[bool,
         log.info(f"Check tag: {tag_name} +{offset} {url}")
 
         result = _try_with_backoff(url)
-        soup = BeautifulSoup(result.content, "html.parser")
+        tree = LexborHTMLParser(result.content)
         # Grab the refTimestamp to avoid murdering Cohost's cache servers
-        links_to_tags = soup.find_all(
-            name="a", href=re.compile("^https://cohost.org/rc/tagged")
-        )
-        the_tag: Optional[Tag] = None
+        links_to_tags = tree.css('a[href^="https://cohost.org/rc/tagged"]')
+        the_tag: Optional[LexborNode] = None
         for a in links_to_tags:
-            if a.find(name="svg", recursive=False) is not None:
+            # the big tag link has an svg icon as a direct child
+            if any(c.tag == "svg" for c in a.iter(include_text=False)):
                 the_tag = a
                 break
         if the_tag is not None:
-            parsed_url = urlparse(the_tag.attrs["href"])
+            parsed_url = urlparse(the_tag.attributes["href"])
             reft = parse_qs(parsed_url.query).get("refTimestamp", None)
         page_count += 1
 
-        post_handle_elements = soup.select(
+        post_handle_elements = tree.css(
             "header.co-thread-header a.co-project-handle"
         )
         post_handles = list(
-            map(lambda x: x.attrs["href"].split("/")[-1], post_handle_elements)
+            map(lambda x: x.attributes["href"].split("/")[-1], post_handle_elements)
         )
         uniques.update(post_handles)
+        if len(uniques) >= target:
+            return True, str(len(uniques))
         if len(post_handles) == 0:
             return len(uniques) >= target, str(len(uniques))
         offset += len(post_handles)
@@ -345,17 +444,19 @@ def get_author_hacky(pid: int):
         "posts.create",
         dumped,
     )
-    create_info = resp.json()
+    create_info = _json(resp)
     known_pid = create_info["result"]["data"]["postId"]
     try:
         # We now know the author.
         timeout = 3
         while 1:
             try:
-                dummy_about = _trpc(
-                    "posts.singlePost",
-                    {"postId": known_pid, "handle": SCRATCHPAD_HANDLE},
-                ).json()
+                dummy_about = _json(
+                    _trpc(
+                        "posts.singlePost",
+                        {"postId": known_pid, "handle": SCRATCHPAD_HANDLE},
+                    )
+                )
             except ValueError:
                 timeout -= 1
                 if timeout == 0:
@@ -366,7 +467,7 @@ def get_author_hacky(pid: int):
                 time.sleep(0.5)
             else:
                 break
-        dummy_model = ExtendedInfoModel(**dummy_about["result"]["data"])
+        dummy_model = ExtendedInfoModel(**_strip_ast_map(dummy_about["result"]["data"]))
 
         # Grab the original author.
         base_post_info = dummy_model.post.shareTree[-1]
@@ -404,7 +505,7 @@ def create_share(
     )
     dumped = model.model_dump(mode="json")
     resp = _trpc_post("posts.create", dumped)
-    create_info = resp.json()
+    create_info = _json(resp)
     known_pid = create_info["result"]["data"]["postId"]
     return known_pid
 
@@ -446,6 +547,7 @@ def enable_shares(pid: int, enabled: bool):
         "posts.setSharesLocked",
         {"postId": pid, "sharesLocked": not enabled},
     )
+    _invalidate()
 
 
 def enable_comments(pid: int, enabled: bool):
@@ -453,6 +555,7 @@ def enable_comments(pid: int, enabled: bool):
         "posts.setCommentsLocked",
         {"postId": pid, "commentsLocked": not enabled},
     )
+    _invalidate()
 
 
 def list_asks(handle: str) -> list[AskModel]:
@@ -463,7 +566,7 @@ def list_asks(handle: str) -> list[AskModel]:
     """
     switchn(handle)
     response = _trpc("asks.listPending", {})
-    ask_data = response.json()["result"]["data"]["asks"]
+    ask_data = _json(response)["result"]["data"]["asks"]
     ask_pack = list(map(lambda json_: AskModel(**json_), ask_data))
     return ask_pack
 
@@ -493,23 +596,73 @@ def next_id() -> int:
         "posts.create",
         dumped,
     )
-    create_info = resp.json()
+    create_info = _json(resp)
     known_pid = create_info["result"]["data"]["postId"]
     # drop immediately
     delete(known_pid, SCRATCHPAD_HANDLE)
     return known_pid
 
 
-def try_post(pid: int):
+@functools.lru_cache(maxsize=64)
+def try_post_raw(pid: int) -> ExtendedInfoDict:
     # grab the basic info
     try:
         author_name = get_author_classic(pid)
     except ValueError:
         author_name = get_author_hacky(pid)
     log.debug(f"id {pid} by {author_name}")
-    extinfo = _trpc("posts.singlePost", {"postId": pid, "handle": author_name}).json()
+    extinfo = _json(_trpc("posts.singlePost", {"postId": pid, "handle": author_name}))
+    return _strip_ast_map(extinfo["result"]["data"])
+
+
+@functools.lru_cache(maxsize=64)
+def try_post(pid: int):
     # shove it into the box
-    return ExtendedInfoModel(**extinfo["result"]["data"])
+    return ExtendedInfoModel(**try_post_raw(pid))
+
+
+def _invalidate():
+    # a post changed server-side; drop the memoized reads. the author of a
+    # pid never changes, so get_author_classic is deliberately left alone --
+    # clearing it here would throw away the batch probe's work every time a
+    # scratchpad cleanup delete fires (get_author_hacky, next_id).
+    try_post_raw.cache_clear()
+    try_post.cache_clear()
+
+
+def try_posts_raw(
+    queries: list[tuple[int, str]]
+) -> list[Optional[ExtendedInfoDict]]:
+    """
+    Batched posts.singlePost: fetch many posts in one round trip.
+    :param queries: (postId, handle) pairs
+    :return: one dict per query, None where that lookup errored
+    """
+    if not queries:
+        return []
+    procedures = ",".join(["posts.singlePost"] * len(queries))
+    input_json = {
+        str(i): {"postId": pid, "handle": handle}
+        for i, (pid, handle) in enumerate(queries)
+    }
+    encoded = quote_plus(json.dumps(input_json, separators=(",", ":")))
+    resp = _try_with_backoff(
+        f"https://cohost.org/api/v1/trpc/{procedures}?batch=1&input={encoded}"
+    )
+    results: list[Optional[ExtendedInfoDict]] = []
+    for entry in _json(resp):
+        if "error" in entry:
+            results.append(None)
+        else:
+            results.append(_strip_ast_map(entry["result"]["data"]))
+    return results
+
+
+def try_posts(queries: list[tuple[int, str]]) -> list[Optional[ExtendedInfoModel]]:
+    return [
+        ExtendedInfoModel(**raw) if raw is not None else None
+        for raw in try_posts_raw(queries)
+    ]
 
 
 def find_the_original_content(post: ExtendedInfoModel):
@@ -524,28 +677,68 @@ def find_the_original_content(post: ExtendedInfoModel):
     while post_model.transparentShareOfPostId is not None:
         index -= 1
         post_model = tree[index]
-    modified = post_model.model_copy(update={"shareTree": tree[: index + 1]}, deep=True)
+    # shallow copy: the result is read-only from here on, so there's no need
+    # to deep-copy every nested submodel
+    modified = post_model.model_copy(update={"shareTree": tree[: index + 1]})
     return ExtendedInfoModel(post=modified, comments=comments)
 
 
+def find_the_original_content_raw(extinfo: ExtendedInfoDict) -> ExtendedInfoDict:
+    post = extinfo["post"]
+    if post["transparentShareOfPostId"] is None:
+        return extinfo  # No change needed.
+
+    tree = post["shareTree"]  # this isn't available on shares.
+    index = -1
+    post = tree[index]
+    while post["transparentShareOfPostId"] is not None:
+        index -= 1
+        post = tree[index]
+    modified = {**post, "shareTree": tree[: index + 1]}
+    return {**extinfo, "post": modified}
+
+
 HANDLE_TO_PID: dict[str, int] = {}
 
 
-def am_login():
+def _invalidate_login():
+    try:
+        os.remove(LOGIN_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def _am_login_live():
     query = r"https://cohost.org/api/v1/trpc/login.loggedIn,projects.listEditedProjects?batch=1&input={}"
     resp = client.get(query)
     if 400 <= resp.status_code <= 599:
         return False, [], f"bad HTTP code: {resp.status_code}"
-    login, projects = resp.json()
+    login, projects = _json(resp)
     if not login["result"]["data"]["loggedIn"]:
         return False, [], "logged in was False"
     projects = projects["result"]["data"]["projects"]
     for project in projects:
         HANDLE_TO_PID[project["handle"]] = project["projectId"]
+    with open(LOGIN_CACHE_FILE, "w") as f:
+        json.dump({"timestamp": time.time(), "projects": HANDLE_TO_PID}, f)
     project_names = list(map(lambda x: x["handle"], projects))
     return True, project_names, "success!"
 
 
+def am_login():
+    # warm start: reuse the cached project map and skip the login round-trip.
+    # a stale cookie surfaces as a 401 later, which re-logs-in for real.
+    try:
+        with open(LOGIN_CACHE_FILE) as f:
+            cached = json.load(f)
+        if time.time() - cached["timestamp"] < LOGIN_CACHE_TTL:
+            HANDLE_TO_PID.update(cached["projects"])
+            return True, list(HANDLE_TO_PID.keys()), "cached"
+    except (OSError, ValueError, KeyError):
+        pass
+    return _am_login_live()
+
+
 def typeof(post: PostModel):
     if post.shareOfPostId is None:
         return "post"
@@ -556,6 +749,16 @@ def typeof(post: PostModel):
     return "share"
 
 
+def typeof_raw(post: PostDict):
+    if post["shareOfPostId"] is None:
+        return "post"
+    if post["transparentShareOfPostId"] is None:
+        return "reply"
+    if post["tags"]:
+        return "tags"
+    return "share"
+
+
 def chain():
     box = try_post(4985784)
     oc = find_the_original_content(box)
@@ -585,9 +788,23 @@ def chain():
         seen.add(item.postId)
         collection.append(item)
         rp(f"  visible: {item.postId}")
+
+    # all the visible share-tree posts (and their authors) are known
+    # upfront, so grab them in a single batched request; the hidden-post
+    # walk below only goes one at a time
+    tree_pids = [p.postId for p in box.post.shareTree]
+    try:
+        batched = try_posts(
+            [(p.postId, p.postingProject.handle) for p in box.post.shareTree]
+        )
+    except ValueError:
+        batched = [None] * len(tree_pids)
+    prefetched = dict(zip(tree_pids, batched))
+
     the_post = box.post
     while the_post.shareTree and typeof(the_post.shareTree[-1]) == "share":
-        shared_post_info = try_post(the_post.shareTree[-1].postId)
+        next_pid = the_post.shareTree[-1].postId
+        shared_post_info = prefetched.get(next_pid) or try_post(next_pid)
         if shared_post_info.post.shareTree and shared_post_info.post.shareTree[-1]:
             the_post = shared_post_info.post
             if the_post.postId not in seen:
@@ -5,22 +5,25 @@ import time
 
 from rich.logging import RichHandler
 
-from cohost import list_asks, post_info, delete, AskModel, ask_reject, am_login
+from cohost import list_asks, post_info_raw, delete, AskModel, ask_reject, am_login
 from settings import POST_TO
 from rich import print as rp
 
-BOT_OP = [
+BOT_OP = frozenset({
     188410,  # @quae-nihl
     217741,  # @randomizer
-]
+})
+ASK_BLOCK = re.compile(r"```@?randomizer\r?\n([\S\s]*?)\r?\n```")
+INSTRUCTION = re.compile(r"^(delete|suppress|unsuppress) (\d+)$")
 log = logging.getLogger("manager")
 
 
 def op_delete(target: int, context: AskModel):
-    post = post_info(target, POST_TO)
+    post = post_info_raw(target, POST_TO)
     if post:
-        immediate_author = post.post.shareTree[-1].postingProject.projectId
-        root_author = post.post.shareTree[0].postingProject.projectId
+        tree = post["post"]["shareTree"]
+        immediate_author = tree[-1]["postingProject"]["projectId"]
+        root_author = tree[0]["postingProject"]["projectId"]
         request_author = context.askingProject.projectId
         if (
             request_author == immediate_author
@@ -35,8 +38,8 @@ def op_delete(target: int, context: AskModel):
             log.warning(
                 f"access violation: "
                 f"{context.askingProject.handle} ({context.askingProject.projectId}) tried to delete"
-                f"share #{target}, but only {post.post.shareTree[-1].postingProject.handle} ({immediate_author}), "
-                f"{post.post.shareTree[0].postingProject.handle} ({root_author}), or a bot-op can do that"
+                f"share #{target}, but only {tree[-1]['postingProject']['handle']} ({immediate_author}), "
+                f"{tree[0]['postingProject']['handle']} ({root_author}), or a bot-op can do that"
             )
     else:
         log.warning(f"{target} does not exist.")
@@ -44,14 +47,12 @@ def op_delete(target: int, context: AskModel):
 
 def parse(content: str, context: AskModel):
     log.info(content)
-    bounds = re.search(r"```@?randomizer\r?\n([\S\s]*?)\r?\n```", content)
+    bounds = ASK_BLOCK.search(content)
     if bounds is None:
         return
     instructions: list[str] = bounds.group(1).splitlines()
     for instruct in instructions:
-        pattern_instruct = re.match(
-            r"^(delete|suppress|unsuppress) (\d+)$", instruct.strip()
-        )
+        pattern_instruct = INSTRUCTION.match(instruct.strip())
         if pattern_instruct is None:
             continue  # invalid instructions (or empty lines) are ok
         op, target = pattern_instruct.groups()
@@ -2,6 +2,7 @@ import logging
 import os.path
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Optional
 
@@ -17,18 +18,25 @@ j2env = Environment(loader=FileSystemLoader(""), autoescape=select_autoescape())
 the_template = j2env.get_template("template.html")
 
 
-def effective_tags(topmost: cohost.PostModel, share: cohost.PostModel):
-    if topmost.postingProject.projectId == share.postingProject.projectId:
-        return set(share.tags)  # you can always share your own post.
-    return set(topmost.tags) & set(share.tags)
+def effective_tags(topmost: cohost.PostDict, share: cohost.PostDict):
+    if topmost["postingProject"]["projectId"] == share["postingProject"]["projectId"]:
+        return set(share["tags"])  # you can always share your own post.
+    return set(topmost["tags"]) & set(share["tags"])
 
 
-def check_ban(model: cohost.PostModel) -> bool:
-    return bool(set(map(lambda x: x.lower(), model.tags)) & banned_tags) or bool(
-        set(map(lambda x: x.lower(), model.cws)) & banned_cws
+def check_ban(post: cohost.PostDict) -> bool:
+    return bool(set(map(lambda x: x.lower(), post["tags"])) & banned_tags) or bool(
+        set(map(lambda x: x.lower(), post["cws"])) & banned_cws
     )
 
 
+def _author_or_none(pid: int) -> Optional[str]:
+    try:
+        return cohost.get_author_classic(pid)
+    except ValueError:
+        return None
+
+
 def main():
     max_duration = 120  # seconds
     while os.path.exists(".lock"):
@@ -57,97 +65,128 @@ def main():
 
         rp(f"{last} -> {latest}")
         ban_list = set()
-        post_info: Optional[cohost.ExtendedInfoModel] = None
+        post_info: Optional[cohost.ExtendedInfoDict] = None
         max_att = 50
         eft = list()
         verify_with = "(none?!)"
         verify_count = -1
+        candidates: list[tuple[int, Optional[cohost.ExtendedInfoDict]]] = []
         while 1:
-            if max_att <= 0:
+            # drain any already-probed candidates before giving up; attempts
+            # can run out mid-refill when the id range is nearly exhausted
+            if max_att <= 0 and not candidates:
                 log.critical(
                     "ran out of attempts or there is no more content to look at"
                 )
                 exit(1)
-            choiced = random.randint(last, latest)
-            if choiced in ban_list:
-                max_att -= 1
+            if not candidates:
+                # probe a whole batch of random IDs at once: resolve authors
+                # concurrently, then fetch every resolvable post in a single
+                # batched trpc call instead of one try_post round trip each
+                batch = set()
+                while len(batch) < 20 and max_att > 0:
+                    choiced = random.randint(last, latest)
+                    if choiced in ban_list:
+                        max_att -= 1
+                        continue
+                    ban_list.add(choiced)
+                    batch.add(choiced)
+                batch = sorted(batch)
+                with ThreadPoolExecutor(max_workers=8) as pool:
+                    authors = list(pool.map(_author_or_none, batch))
+                known = [(pid, a) for pid, a in zip(batch, authors) if a is not None]
+                try:
+                    fetched = cohost.try_posts_raw(known)
+                except ValueError as e:
+                    log.error(e)
+                    fetched = [None] * len(known)
+                by_pid = {pid: info for (pid, _), info in zip(known, fetched)}
+                # unresolvable posts fall back to the one-at-a-time path
+                # below (the share trick needs it anyway)
+                candidates = [(pid, by_pid.get(pid)) for pid in batch]
                 continue
-            ban_list.add(choiced)
+            choiced, probed = candidates.pop(0)
             try:
-                post_info = cohost.try_post(choiced)
-                oc = cohost.find_the_original_content(post_info)
-                describe = f"[bold bright_cyan]{post_info.post.postId}[/] by [yellow]@{post_info.post.postingProject.handle}[/]"
-                if oc.post.postId != post_info.post.postId:
+                post_info = (
+                    probed if probed is not None else cohost.try_post_raw(choiced)
+                )
+                the_post = post_info["post"]
+                oc = cohost.find_the_original_content_raw(post_info)
+                describe = f"[bold bright_cyan]{the_post['postId']}[/] by [yellow]@{the_post['postingProject']['handle']}[/]"
+                if oc["post"]["postId"] != the_post["postId"]:
                     # Nothing added.
                     log.info(
                         f"SKIP {describe}: [red]not additive[/]", extra={"markup": True}
                     )
                     continue
-                if post_info.post.effectiveAdultContent:
+                if the_post["effectiveAdultContent"]:
                     log.info(
                         f"SKIP {describe}: [red]adult content[/]",
                         extra={"markup": True},
                     )
                     continue
-                if post_info.post.postingProject.handle in ban_list:
+                if the_post["postingProject"]["handle"] in ban_list:
                     log.info(
                         f"SKIP {describe}: [red]banlist[/]", extra={"markup": True}
                     )
                     continue
-                if check_ban(post_info.post):
+                if check_ban(the_post):
                     log.info(
                         f"SKIP {describe}: [red]tag ban[/]", extra={"markup": True}
                     )
                     continue
-                if post_info.post.shareTree:
-                    if check_ban(post_info.post.shareTree[0]):
+                if the_post["shareTree"]:
+                    if check_ban(the_post["shareTree"][0]):
                         log.info(
                             f"SKIP {describe}: [red]tag ban[/]", extra={"markup": True}
                         )
                         continue
 
-                if not post_info.post.canShare:
+                if not the_post["canShare"]:
                     log.info(
                         f"SKIP {describe}: [red]can't share[/]", extra={"markup": True}
                     )
                     continue
                 if (
-                    "🤖" in post_info.post.postingProject.displayName
-                    or post_info.post.postingProject.handle.endswith("-bot")
+                    "🤖" in the_post["postingProject"]["displayName"]
+                    or the_post["postingProject"]["handle"].endswith("-bot")
                 ):
                     log.info(f"SKIP {describe}: [red]bot[/]", extra={"markup": True})
                     continue
 
-                if not post_info.post.tags:
+                if not the_post["tags"]:
                     log.info(
                         f"SKIP {describe}: [red]published to followers only (no tags)[/]",
                         extra={"markup": True},
                     )
                     continue
-                if post_info.post.shareTree:
-                    eft = list(
-                        effective_tags(post_info.post.shareTree[0], post_info.post)
-                    )
+                if the_post["shareTree"]:
+                    eft = list(effective_tags(the_post["shareTree"][0], the_post))
                     if not eft:
                         log.info(
                             f"SKIP {describe}: [red]no effective tags[/] "
-                            f"[bright_blue](no overlap between {post_info.post.shareTree[0].tags} and {post_info.post.tags})[/]",
+                            f"[bright_blue](no overlap between {the_post['shareTree'][0]['tags']} and {the_post['tags']})[/]",
                             extra={"markup": True},
                         )
                         continue
                 else:
-                    eft = post_info.post.tags
+                    eft = the_post["tags"]
 
                 any_pass_usage_check = False
-                for tag in eft:
-                    if len(tag) > 50:  # Probably talking in tags.
-                        continue
-                    pass_, count = cohost.tag_analyze(tag, 3)
-                    if pass_:
-                        any_pass_usage_check = True
-                        verify_with = tag
-                        verify_count = count
-                        break
+                check_tags = [tag for tag in eft if len(tag) <= 50]
+                # len > 50: probably talking in tags.
+                if check_tags:
+                    # tag checks are independent, so overlap the HTTP waits
+                    with ThreadPoolExecutor(max_workers=4) as pool:
+                        results = pool.map(
+                            lambda tag: cohost.tag_analyze(tag, 3), check_tags
+                        )
+                        for tag, (pass_, count) in zip(check_tags, results):
+                            if pass_:
+                                any_pass_usage_check = True
+                                verify_with = tag
+                                verify_count = count
+                                break
                 if not any_pass_usage_check:
                     log.info(
                         f"SKIP {describe}: [red]no tags used by others[/] [bright_blue](of {eft})[/]",
@@ -159,59 +198,48 @@ def main():
                 log.error(e)
         assert post_info is not None
 
-        # Share the post.
-        content = the_template.render(
-            original_href=post_info.post.singlePostPageUrl,
-            typeof=cohost.typeof(post_info.post),
+        # Share the post. Both renders differ only by delete_url, so build
+        # the rest of the context once.
+        the_post = post_info["post"]
+        render_args = dict(
+            original_href=the_post["singlePostPageUrl"],
+            typeof=cohost.typeof_raw(the_post),
             no_eff_tags=len(eft),
-            eff_tags_label=f"effective tags" if post_info.post.shareTree else "tags",
+            eff_tags_label=f"effective tags" if the_post["shareTree"] else "tags",
             which_tag=f"#{verify_with}",
             tag_use_count=verify_count,
-            pid=post_info.post.postId,
-            handle=post_info.post.postingProject.handle,
-            uid=post_info.post.postingProject.projectId,
+            pid=the_post["postId"],
+            handle=the_post["postingProject"]["handle"],
+            uid=the_post["postingProject"]["projectId"],
             timestamp=datetime.now(tz=timezone.utc).strftime(
                 "%a %m %B, %Y %H:%M:%S %Z"
             ),
             total_count=latest - last,
             percentage=f"{100.0 / (latest - last):.3f}",
-            delete_url="[[delete_url]]",
         )
+        content = the_template.render(delete_url="[[delete_url]]", **render_args)
         cohost.switchn(POST_TO)  # required for the locking for some reason.
         pid = cohost.create_share(
             POST_TO,
-            post_info.post.postId,
+            the_post["postId"],
             [cohost.MarkdownBlock.of(content)],
             ["bot", "randomizer/random-post"],
         )
         time.sleep(0.5)
         cohost.enable_shares(pid, False)
         cohost.enable_comments(pid, False)
-        permitted = [post_info.post.postingProject.handle]
-        if post_info.post.shareTree:
-            permitted.append(post_info.post.shareTree[0].postingProject.handle)
+        permitted = [the_post["postingProject"]["handle"]]
+        if the_post["shareTree"]:
+            permitted.append(the_post["shareTree"][0]["postingProject"]["handle"])
         perm_string = "".join(map(lambda x: f"&permitted={x}", permitted))
         new_content = the_template.render(
-            original_href=post_info.post.singlePostPageUrl,
-            typeof=cohost.typeof(post_info.post),
-            no_eff_tags=len(eft),
-            eff_tags_label=f"effective tags" if post_info.post.shareTree else "tags",
-            which_tag=f"#{verify_with}",
-            tag_use_count=verify_count,
-            pid=post_info.post.postId,
-            handle=post_info.post.postingProject.handle,
-            uid=post_info.post.postingProject.projectId,
-            timestamp=datetime.now(tz=timezone.utc).strftime(
-                "%a %m %B, %Y %H:%M:%S %Z"
-            ),
-            total_count=latest - last,
-            percentage=f"{100.0 / (latest - last):.3f}",
             delete_url=f"https://penguinencounter.github.io/cohost-randombot/del.html?target={pid}{perm_string}",
+            **render_args,
         )
         cohost.edit_share(
             pid,
             POST_TO,
-            post_info.post.postId,
+            the_post["postId"],
             [cohost.MarkdownBlock.of(new_content)],
             ["bot", "randomizer/random-post"],
         )
@@ -223,5 +251,6 @@ def main():
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG, handlers=[RichHandler()])
-    logging.getLogger("urllib3.connectionpool").setLevel(logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.INFO)
     main()
@@ -4,12 +4,10 @@ from dotenv import load_dotenv
 from os import environ
 from os.path import join, dirname
 
-BANS = set()
+BANS = frozenset()
 if os.path.exists("banlist.txt"):
     with open("banlist.txt") as f:
-        read = list(f.read().splitlines())
-        for line in read:
-            BANS.add(line.strip())
+        BANS = frozenset(line.strip() for line in f.read().splitlines())
 
 load_dotenv(join(dirname(__file__), ".env"))
 